@@ -10,5 +10,14 @@ celery = Celery(
     include="app.api.celery_task",  # route where tasks are defined
 )
 
-celery.conf.update({"beat_dburi": str(settings.SYNC_CELERY_BEAT_DATABASE_URI)})
+celery.conf.update(
+    {
+        "beat_dburi": str(settings.SYNC_CELERY_BEAT_DATABASE_URI),
+        # Compress task messages and stored results (gzip is built into kombu, zstd needs the zstandard package)
+        "task_compression": "gzip",
+        "result_compression": "gzip",
+        # Results are only polled shortly after the task finishes
+        "result_expires": 3600,
+    }
+)
 celery.autodiscover_tasks()
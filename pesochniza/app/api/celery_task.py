@@ -3,14 +3,21 @@
 import logging
 import os
 import pandas as pd
-from typing import List, Dict, Any
-import uuid # Для создания уникальных имен файлов
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from celery.signals import worker_process_init
 
 from app.core.celery import celery
 # Убедитесь, что эти импорты корректны и функции существуют
-from app.utils.json_processor import parse_json_files_to_roots, create_dataframe
-from app.utils.environment_processing import extract_environment_info
-from app.utils.file_utils import save_to_csv
+from app.utils.json_processor import parse_json_files_to_table
+from app.models.event_models import EVENT_SCHEMA
+from app.utils.environment_processing import extract_environment_info_batch, WINDOW_SCHEMA
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,57 +26,103 @@ logger = logging.getLogger(__name__)
 # Определяем базовый каталог для временных файлов, доступный для воркеров
 # Возможно, стоит вынести это в настройки приложения
 TEMP_DIR = '/app/temp_celery_files'
-os.makedirs(TEMP_DIR, exist_ok=True)
+
+
+@worker_process_init.connect
+def _ensure_temp_dir(**_):
+    """Создает TEMP_DIR при старте процесса воркера (а не при импорте модуля, например, в FastAPI)."""
+    Path(TEMP_DIR).mkdir(parents=True, exist_ok=True)
+
+
+# Столбцы исходных событий, которые не попадают в итоговый результат
+COLUMNS_TO_DROP = ['batch_id', 'related_file', 'log_record_counter', 'program_titles']
+
+# Поддерживаемые форматы результата: '<формат>.<сжатие>' или 'csv'
+OUTPUT_FORMATS = ('feather.lz4', 'feather.zstd', 'parquet.snappy', 'csv')
+
+
+
+def build_output_schema(event_schema: pa.Schema) -> pa.Schema:
+    """
+    Схема результата: столбцы событий без environment и COLUMNS_TO_DROP,
+    затем поля окон из WINDOW_SCHEMA (совпадающие с событием имена получают префикс env_).
+    """
+    kept_fields = [field for field in event_schema if field.name != 'environment' and field.name not in COLUMNS_TO_DROP]
+    kept_names = {field.name for field in kept_fields}
+    window_fields = [field.with_name(f'env_{field.name}') if field.name in kept_names else field for field in WINDOW_SCHEMA]
+    return pa.schema(kept_fields + window_fields)
+
+
+# Схема результата строится один раз при импорте, а не выводится из pandas на каждую запись
+OUTPUT_SCHEMA = build_output_schema(EVENT_SCHEMA)
+
+# Столбцы событий в результате (без полей окон)
+EVENT_OUTPUT_COLUMNS = OUTPUT_SCHEMA.names[:-len(WINDOW_SCHEMA)]
+
+# Строковые столбцы с малым числом различных значений: пишутся словарными (категориальными)
+DICTIONARY_COLUMNS = ('user_id', 'event_type', 'root_app')
+
+# Размер пачки событий при потоковой обработке: память задачи ограничена пачкой, а не всем входом
+ENV_BATCH_SIZE = 50_000
+
+
+def extract_environment_column(environment: pd.Series) -> pd.DataFrame:
+    """
+    Применяет extract_environment_info ко всему столбцу environment
+    (через extract_environment_info_batch).
+
+    Пустые значения отсекаются маской заранее, остальные обрабатываются одним вызовом.
+
+    Args:
+        environment: Столбец environment с JSON строками.
+
+    Returns:
+        pd.DataFrame с одной строкой на окно; индекс - индекс исходного события.
+    """
+    values = environment[environment.fillna('').ne('').to_numpy(dtype=bool)]
+    return extract_environment_info_batch(values)
 
 
 @celery.task(bind=True) # bind=True позволяет получить доступ к self (инстансу задачи)
-def process_event_logs_to_dataframe_task(self, base_path: str) -> str: # <-- Возвращает путь к файлу (строка)
+def process_event_logs_to_dataframe_task(self, base_path: str) -> Optional[str]: # <-- Возвращает путь к файлу (строка)
     """
-    Celery task to find, parse JSON event log files, create DataFrame,
-    and save it to a temporary Parquet file.
+    Celery task to find and read JSON event log files into an Arrow table
+    and save it to a temporary Arrow IPC (Feather v2) file.
 
     Args:
         base_path: The base file system path where logs are located.
 
     Returns:
-        The absolute path to the temporary Parquet file on success.
+        The absolute path to the temporary Arrow file on success,
+        or None if no events were found.
         Raises an exception on failure.
     """
     task_id = self.request.id
     logger.info(f"Task {task_id} started: process_event_logs_to_dataframe_task with base_path='{base_path}'")
-    self.update_state(state='PROGRESS', meta={'current': 0, 'total': 3, 'status': 'Parsing JSON files'})
+    self.update_state(state='PROGRESS', meta={'current': 0, 'total': 2, 'status': 'Reading JSON files'})
 
     try:
-        # Шаг 1: Парсим JSON файлы в объекты Root
-        all_roots = parse_json_files_to_roots(base_path)
-        logger.info(f"Task {task_id}: Finished parsing JSON files. Got {len(all_roots)} Root objects.")
-        self.update_state(state='PROGRESS', meta={'current': 1, 'total': 3, 'status': 'Creating DataFrame'})
-
-        # Шаг 2: Создаем DataFrame из объектов Root
-        events_df = create_dataframe(all_roots)
-        logger.info(f"Task {task_id}: Finished creating DataFrame. Got {len(events_df)} rows.")
-        self.update_state(state='PROGRESS', meta={'current': 2, 'total': 3, 'status': 'Saving DataFrame to temp file'})
-
-        if events_df.empty:
-            logger.warning(f"Task {task_id}: No data processed. DataFrame is empty.")
-            # Создаем пустой файл-заглушку или возвращаем специальное значение,
-            # если следующая задача не может обработать пустой файл
-            # Для простоты, сохраним пустой файл.
-            temp_file_path = os.path.join(TEMP_DIR, f'events_raw_{task_id}_{uuid.uuid4()}.parquet')
-            events_df.to_parquet(temp_file_path, index=False)
-            logger.info(f"Task {task_id}: Saved empty DataFrame to {temp_file_path}")
-            self.update_state(state='SUCCESS', meta={'current': 3, 'total': 3, 'status': 'Completed (empty data)'})
-            return temp_file_path
-
-
-        # Шаг 3: Сохраняем DataFrame во временный файл (например, Parquet)
-        # Используем ID задачи для уникальности имени файла
-        temp_file_path = os.path.join(TEMP_DIR, f'events_raw_{task_id}_{uuid.uuid4()}.parquet')
-        # Убедимся, что директория существует (уже сделано выше)
-        # Сохраняем в Parquet, так как он эффективнее для Pandas
-        events_df.to_parquet(temp_file_path, index=False)
-        logger.info(f"Task {task_id}: DataFrame saved to temporary file: {temp_file_path}")
-        self.update_state(state='PROGRESS', meta={'current': 3, 'total': 3, 'status': 'Completed'})
+        # Шаг 1: Читаем JSON файлы сразу в Arrow таблицу (без объектов Root/BaseEvent)
+        events_table = parse_json_files_to_table(base_path)
+        logger.info(f"Task {task_id}: Finished reading JSON files. Got {events_table.num_rows} rows.")
+        self.update_state(state='PROGRESS', meta={'current': 1, 'total': 2, 'status': 'Saving table to temp file'})
+
+        if events_table.num_rows == 0:
+            # Пустой файл не пишем: следующая задача получает None и сразу завершается
+            logger.warning(f"Task {task_id}: No data processed. Temporary file is not created.")
+            self.update_state(state='SUCCESS', meta={'current': 2, 'total': 2, 'status': 'Completed (empty data)'})
+            return None
+
+        # Шаг 2: Сохраняем таблицу во временный Arrow IPC (Feather v2) файл без промежуточного pandas DataFrame.
+        # Файл читает только следующая задача на том же воркере, поэтому Parquet здесь избыточен.
+        # ID задачи Celery уже уникален, поэтому он и служит именем файла.
+        # В таблице по куску на каждый JSON файл, а chunksize только делит куски, но не склеивает их:
+        # combine_chunks нужен, чтобы в файле были пачки по ENV_BATCH_SIZE строк, а не по пачке на файл
+        temp_file_path = os.path.join(TEMP_DIR, f'events_raw_{task_id}.arrow')
+        feather.write_feather(events_table.combine_chunks(), temp_file_path, compression='lz4', chunksize=ENV_BATCH_SIZE)
+
+        logger.info(f"Task {task_id}: Table saved to temporary file: {temp_file_path}")
+        self.update_state(state='PROGRESS', meta={'current': 2, 'total': 2, 'status': 'Completed'})
 
         # Возвращаем путь к сохраненному файлу
         return temp_file_path
@@ -82,35 +135,258 @@ def process_event_logs_to_dataframe_task(self, base_path: str) -> str: # <-- В
         raise
 
 
-@celery.task(bind=True, name='process_environment_batch')
+def transform_environment_data(batch: pa.RecordBatch, task_id: str) -> pa.Table:
+    """
+    Шаги обработки одной пачки событий: извлечение окон из environment,
+    разворачивание, сборка итоговых столбцов и фильтрация по root_app.
+
+    Окна приходят из extract_environment_info_batch уже плоской таблицей
+    со столбцами Arrow, а столбцы событий повторяются для каждого окна
+    через take (в C, без Python объектов на строку).
+
+    Args:
+        batch: Пачка событий со столбцом 'environment'.
+        task_id: ID задачи Celery (для логов).
+
+    Returns:
+        pa.Table с одной строкой на окно (может быть пустой).
+    """
+    # --- ПРИМЕНЕНИЕ ФУНКЦИИ ОБРАБОТКИ И РАЗВОРАЧИВАНИЕ ---
+    # Одна строка на окно; индекс - номер исходного события в пачке (аналог explode)
+    windows = extract_environment_column(batch.column('environment').to_pandas(types_mapper=pd.ArrowDtype))
+    parent_indices = pa.array(windows.index.to_numpy(), type=pa.int64())
+
+    if windows.empty:
+        logger.info(f"Task {task_id}: No window data in batch after exploding.")
+
+    window_columns = [pa.array(windows[field.name], type=field.type) for field in WINDOW_SCHEMA]
+
+    # --- СБОРКА ИТОГОВЫХ СТОЛБЦОВ ---
+    # Столбцы событий повторяются для каждого окна через take
+    # Схема пачки проверяется один раз на задачу в check_batch_schema, здесь берется готовая OUTPUT_SCHEMA
+    kept_columns = [batch.column(name).take(parent_indices) for name in EVENT_OUTPUT_COLUMNS]
+    processed_table = pa.Table.from_arrays(kept_columns + window_columns, schema=OUTPUT_SCHEMA)
+
+    # --- ФИЛЬТРАЦИЯ ПО root_app ---
+    # not_equal дает null для null root_app, а filter отбрасывает null вместе с false
+    return processed_table.filter(pc.not_equal(processed_table.column('root_app'), ''))
+
+
+def check_batch_schema(batch_schema: pa.Schema) -> None:
+    """
+    Проверяет, что из пачек с такой схемой получается результат со схемой OUTPUT_SCHEMA.
+
+    Raises:
+        ValueError: Если столбцы или типы пачки не совпадают с EVENT_SCHEMA.
+    """
+    batch_output_schema = build_output_schema(batch_schema)
+    if batch_output_schema != OUTPUT_SCHEMA:
+        raise ValueError(f"Batch schema does not match OUTPUT_SCHEMA: expected {OUTPUT_SCHEMA}, got {batch_output_schema}")
+
+
+class ProcessedDataWriter:
+    """
+    Пишет результат по частям в один файл в формате из OUTPUT_FORMATS.
+    Файл создается при первой записи, все части приводятся к схеме schema.
+
+    Столбцы из DICTIONARY_COLUMNS в Feather/Parquet пишутся словарными
+    (категориальными). Словарь общий для всего файла и только дополняется
+    новыми значениями: IPC файл не допускает замену словаря между пачками.
+
+    Части пишутся во временный файл '<путь>.part', который переименовывается
+    в output_full_path в close(). При ошибке abort() удаляет временный файл,
+    так что по итоговому пути не остается недописанного результата.
+    """
+
+    def __init__(self, output_full_path: str, output_format: str, schema: pa.Schema = OUTPUT_SCHEMA):
+        self.output_full_path = output_full_path
+        self.output_format = output_format
+        self.part_path = f'{output_full_path}.part'
+        self.schema = pa.schema([
+            field.with_type(pa.dictionary(pa.int32(), field.type)) if field.name in DICTIONARY_COLUMNS else field
+            for field in schema
+        ])
+        self.rows_written = 0
+        self._writer = None
+        self._dictionaries: Dict[str, pa.Array] = {}
+
+    def _dictionary_encode(self, name: str, column: pa.ChunkedArray) -> pa.DictionaryArray:
+        values = column.combine_chunks()
+        dictionary = self._dictionaries.get(name, pa.array([], type=values.type))
+        new_values = pc.unique(values.filter(pc.invert(pc.is_in(values, value_set=dictionary))).drop_null())
+        if len(new_values):
+            dictionary = pa.concat_arrays([dictionary, new_values])
+            self._dictionaries[name] = dictionary
+        return pa.DictionaryArray.from_arrays(pc.index_in(values, value_set=dictionary), dictionary)
+
+    def write(self, table: pa.Table) -> None:
+        if self.output_format == 'csv':
+            table.to_pandas(types_mapper=pd.ArrowDtype).to_csv(
+                self.part_path, mode='a' if self.rows_written else 'w',
+                header=not self.rows_written, index=False,
+            )
+        else:
+            for name in DICTIONARY_COLUMNS:
+                table = table.set_column(
+                    table.schema.get_field_index(name), name, self._dictionary_encode(name, table.column(name)),
+                )
+            table = table.cast(self.schema)
+            if self._writer is None:
+                file_format, compression = self.output_format.split('.', 1)
+                if file_format == 'feather':
+                    self._writer = pa.ipc.new_file(
+                        self.part_path, self.schema,
+                        options=pa.ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True),
+                    )
+                else:
+                    self._writer = pq.ParquetWriter(self.part_path, self.schema, compression=compression)
+            self._writer.write_table(table)
+        self.rows_written += table.num_rows
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self) -> None:
+        """Завершает запись и переносит файл на итоговый путь (если что-то записано)."""
+        self._close_writer()
+        if self.rows_written:
+            os.replace(self.part_path, self.output_full_path)
+
+    def abort(self) -> None:
+        """Прерывает запись и удаляет временный файл."""
+        try:
+            self._close_writer()
+        finally:
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+
+
+def process_environment_batches(batches: Iterable[pa.RecordBatch],
+                                num_batches: int,
+                                output_full_path: str,
+                                output_format: str,
+                                task_id: str,
+                                report_progress: Callable[[int, int], None]) -> int:
+    """
+    Обрабатывает события пачками и дописывает результат каждой пачки в выходной файл,
+    так что в памяти одновременно находится только одна пачка.
+
+    Args:
+        batches: Пачки событий (Arrow RecordBatch) со столбцом 'environment'.
+        num_batches: Общее число пачек (для прогресса).
+        output_full_path: Полный путь к выходному файлу.
+        output_format: Формат результата из OUTPUT_FORMATS.
+        task_id: ID задачи Celery (для логов).
+        report_progress: Функция (номер обработанной пачки, всего пачек) для обновления состояния задачи.
+
+    Returns:
+        Число записанных строк. Если 0 или при ошибке, выходной файл не создается.
+
+    Raises:
+        ValueError: Если схема пачек не совпадает с EVENT_SCHEMA (см. check_batch_schema).
+    """
+    writer = ProcessedDataWriter(output_full_path, output_format)
+    try:
+        for batch_number, batch in enumerate(batches, start=1):
+            if batch_number == 1:
+                # У всех пачек одного источника одна схема: достаточно проверить первую
+                check_batch_schema(batch.schema)
+            processed_table = transform_environment_data(batch, task_id)
+            if processed_table.num_rows:
+                writer.write(processed_table)
+            logger.info(f"Task {task_id}: Batch {batch_number}/{num_batches} processed, {processed_table.num_rows} records.")
+            report_progress(batch_number, num_batches)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.rows_written
+
+
+def check_output_format(task, output_format: str) -> Optional[Dict[str, str]]:
+    """
+    Проверяет, что output_format входит в OUTPUT_FORMATS.
+
+    Returns:
+        None, если формат поддерживается, иначе словарь ошибки для возврата из задачи
+        (состояние задачи уже переведено в FAILURE).
+    """
+    if output_format in OUTPUT_FORMATS:
+        return None
+    error_msg = f"Unsupported output_format '{output_format}'. Expected one of: {', '.join(OUTPUT_FORMATS)}"
+    logger.error(f"Task {task.request.id}: {error_msg}")
+    task.update_state(state='FAILURE', meta={'error': error_msg})
+    return {"status": "error", "message": error_msg}
+
+
+def report_batch_progress(task) -> Callable[[int, int], None]:
+    """Функция для report_progress в process_environment_batches: обновляет состояние задачи."""
+    return lambda current, total: task.update_state(
+        state='PROGRESS', meta={'current': current, 'total': total, 'status': 'Processing batches'},
+    )
+
+
+def finish_processing(task, rows_written: int, num_batches: int, output_full_path: str) -> Dict[str, str]:
+    """
+    Переводит задачу в SUCCESS после process_environment_batches.
+
+    Returns:
+        Словарь с результатом задачи (путь к файлу, если что-то записано).
+    """
+    task_id = task.request.id
+    if rows_written == 0:
+        logger.info(f"Task {task_id}: No window data remaining after processing. Task finished.")
+        task.update_state(state='SUCCESS', meta={'current': num_batches, 'total': num_batches, 'status': 'Completed (no data)'})
+        return {"status": "success", "message": "No window data remaining after processing."}
+
+    logger.info(f"Task {task_id}: Successfully saved {rows_written} records to {output_full_path}")
+    task.update_state(state='SUCCESS', meta={'current': num_batches, 'total': num_batches, 'status': 'Completed'})
+    return {"status": "success", "message": "Data processed and saved successfully", "file_path": output_full_path}
+
+
+@celery.task(bind=True, name='process_environment_batch', compression='gzip')
 # Изменяем аргументы: теперь принимаем путь к входному файлу как первый позиционный аргумент
 def process_environment_batch_task(self,
                                    input_file_path: str, # <-- Путь к файлу с исходными данными
-                                   output_filename: str = 'processed_environment_data.csv',
-                                   output_base_path: str = '/app/processed_data'):
+                                   output_filename: str = 'processed_environment_data.feather',
+                                   output_base_path: str = '/app/processed_data',
+                                   output_format: str = 'feather.zstd'):
     """
     Celery task to read data from a file, process environment data,
-    extract window information, and save the result to a CSV file.
-    Reads data from input_file_path (usually from a previous task).
+    extract window information, and save the result to a file
+    (compressed Feather by default, see OUTPUT_FORMATS).
+    Reads data from input_file_path (usually from a previous task)
+    batch by batch, so memory usage does not grow with the input size.
 
     Args:
-        input_file_path: Полный путь к файлу (например, Parquet) с исходными данными,
+        input_file_path: Полный путь к Arrow (Feather) файлу с исходными данными,
                          содержащими столбец 'environment'. Этот аргумент
-                         получается автоматически от предыдущей задачи в цепочке.
-        output_filename: Имя CSV файла для сохранения.
+                         получается автоматически от предыдущей задачи в цепочке
+                         (None, если событий не было).
+        output_filename: Имя файла для сохранения.
         output_base_path: Базовый путь для сохранения файла.
+        output_format: Формат результата из OUTPUT_FORMATS ('csv' - несжатый CSV).
 
     Returns:
         Словарь с результатом (путь к файлу или сообщение об ошибке).
     """
     task_id = self.request.id
     logger.info(f"Task {task_id} started: process_environment_batch_task")
+    if not input_file_path:
+        logger.info(f"Task {task_id}: No input file (previous task found no events). Nothing to process.")
+        self.update_state(state='SUCCESS', meta={'current': 1, 'total': 1, 'status': 'Completed (empty input)'})
+        return {"status": "success", "message": "No input"}
     logger.info(f"Input file: {input_file_path}")
     logger.info(f"Output path: {os.path.join(output_base_path, output_filename)}")
-    self.update_state(state='PROGRESS', meta={'current': 0, 'total': 6, 'status': 'Loading data'})
+    format_error = check_output_format(self, output_format)
+    if format_error:
+        return format_error
+    self.update_state(state='PROGRESS', meta={'current': 0, 'total': 1, 'status': 'Loading data'})
 
     try:
-        # --- ШАГ 1: ЗАГРУЗКА ДАННЫХ ИЗ ФАЙЛА ---
+        # --- ШАГ 1: ОТКРЫТИЕ ФАЙЛА С ДАННЫМИ ---
         if not os.path.exists(input_file_path):
             error_msg = f"Input file not found: {input_file_path}"
             logger.error(f"Task {task_id}: {error_msg}")
@@ -120,18 +396,17 @@ def process_environment_batch_task(self,
 
         logger.info(f"Task {task_id}: Reading data from {input_file_path}...")
         try:
-            # Читаем из Parquet файла, созданного предыдущей задачей
-            data = pd.read_parquet(input_file_path)
+            # Открываем Arrow файл, созданный предыдущей задачей, как dataset: сканер читает
+            # пачки по одной, не читает столбцы из COLUMNS_TO_DROP и сразу (в C) отбрасывает
+            # события с пустым environment, которые все равно не дают ни одного окна.
+            dataset = ds.dataset(input_file_path, format='ipc')
         except Exception as read_error:
              error_msg = f"Failed to read input file {input_file_path}: {read_error}"
              logger.error(f"Task {task_id}: {error_msg}", exc_info=True)
              self.update_state(state='FAILURE', meta={'error': error_msg})
              return {"status": "error", "message": error_msg}
 
-        logger.info(f"Task {task_id}: Successfully loaded {len(data)} records from {input_file_path}.")
-        self.update_state(state='PROGRESS', meta={'current': 1, 'total': 6, 'status': 'Applying processing function'})
-
-        # --- ОПЦИОНАЛЬНО: Удаление временного файла после загрузки ---
+        # --- ОПЦИОНАЛЬНО: Удаление временного файла после обработки ---
         # Важно убедиться, что файл больше не нужен другим задачам или процессам
         # try:
         #     os.remove(input_file_path)
@@ -140,100 +415,98 @@ def process_environment_batch_task(self,
         #     logger.warning(f"Task {task_id}: Failed to remove temporary input file {input_file_path}: {rm_error}")
         # -----------------------------------------------------------
 
-        if 'environment' not in data.columns:
+        if 'environment' not in dataset.schema.names:
             error_msg = "Column 'environment' not found in the input data. Task aborted."
             logger.error(f"Task {task_id}: {error_msg}")
             self.update_state(state='FAILURE', meta={'error': error_msg})
             return {"status": "error", "message": error_msg}
 
-        if data.empty:
-             logger.info(f"Task {task_id}: Input DataFrame is empty. Nothing to process.")
-             self.update_state(state='SUCCESS', meta={'current': 6, 'total': 6, 'status': 'Completed (empty input)'})
-             return {"status": "success", "message": "Input data was empty, nothing processed."}
-
-
-        # --- ШАГ 2: ПРИМЕНЕНИЕ ФУНКЦИИ ОБРАБОТКИ ---
-        logger.info(f"Task {task_id}: Applying extract_environment_info...")
-        data['env_info'] = data['environment'].apply(
-            lambda x: extract_environment_info(x) if pd.notna(x) and x else None
+        # Сканер отдает по пачке на каждую пачку файла (в том числе пустую после фильтра),
+        # поэтому число пачек для прогресса берется из футера файла
+        with pa.ipc.open_file(input_file_path) as reader:
+            num_batches = reader.num_record_batches
+        logger.info(f"Task {task_id}: Input file has {num_batches} batches.")
+
+        # --- ШАГ 2: ПОТОКОВАЯ ОБРАБОТКА И СОХРАНЕНИЕ ---
+        needed_columns = [name for name in dataset.schema.names if name not in COLUMNS_TO_DROP]
+        scanner = dataset.scanner(
+            columns=needed_columns,
+            filter=ds.field('environment').is_valid() & (ds.field('environment') != ''),
+            batch_size=ENV_BATCH_SIZE,
         )
-        logger.info(f"Task {task_id}: extract_environment_info completed.")
-        self.update_state(state='PROGRESS', meta={'current': 2, 'total': 6, 'status': 'Filtering and exploding'})
-
-
-        # --- ШАГ 3: ФИЛЬТРАЦИЯ И РАЗВОРАЧИВАНИЕ ---
-        logger.info(f"Task {task_id}: Filtering and exploding data...")
-        data_processed = data[data['env_info'].notna()].copy()
-
-        if data_processed.empty:
-            logger.info(f"Task {task_id}: No valid environment data to process after initial filtering. Task finished.")
-            self.update_state(state='SUCCESS', meta={'current': 6, 'total': 6, 'status': 'Completed (no valid env data)'})
-            return {"status": "success", "message": "No valid environment data to process."}
-
-        data_processed['env_info'] = data_processed['env_info'].apply(lambda x: x if isinstance(x, list) else [])
-        data_exploded = data_processed.explode('env_info').copy()
-
-        if data_exploded.empty:
-             logger.info(f"Task {task_id}: No window data found after exploding. Task finished.")
-             self.update_state(state='SUCCESS', meta={'current': 6, 'total': 6, 'status': 'Completed (no window data)'})
-             return {"status": "success", "message": "No window data found after processing."}
+        output_full_path = os.path.join(output_base_path, output_filename)
+        logger.info(f"Task {task_id}: Processing batches and saving ({output_format}) to {output_full_path}...")
+        rows_written = process_environment_batches(
+            scanner.to_batches(), num_batches, output_full_path, output_format, task_id, report_batch_progress(self),
+        )
+        return finish_processing(self, rows_written, num_batches, output_full_path)
 
-        env_info_df = data_exploded['env_info'].apply(lambda x: pd.Series(x) if isinstance(x, dict) else pd.Series({}))
+    except Exception as e:
+        error_msg = f"An unexpected error occurred during task execution: {e}"
+        logger.error(f"Task {task_id}: {error_msg}", exc_info=True)
+        self.update_state(state='FAILURE', meta={'error': error_msg})
+        # Не переподнимаем исключение, так как возвращаем словарь ошибки
+        return {"status": "error", "message": error_msg}
 
-        original_columns = data_processed.drop(columns=['environment', 'env_info'], errors='ignore').columns
 
-        data_exploded = data_exploded.reset_index(drop=True)
-        env_info_df = env_info_df.reset_index(drop=True)
+@celery.task(bind=True, name='process_events_to_file')
+def process_events_to_file_task(self,
+                                base_path: str,
+                                output_filename: str = 'processed_environment_data.feather',
+                                output_base_path: str = '/app/processed_data',
+                                output_format: str = 'feather.zstd'):
+    """
+    Celery task that runs the whole environment workflow in one process:
+    reads JSON event logs, extracts window information and saves the result
+    to a file (compressed Feather by default, see OUTPUT_FORMATS).
+    Unlike the process_event_logs_to_dataframe_task |
+    process_environment_batch_task chain, the events are kept in memory,
+    so there is no temporary file and no second task dispatch.
 
-        processed_df = pd.concat([data_exploded[original_columns], env_info_df], axis=1)
-        logger.info(f"Task {task_id}: Filtering and exploding completed.")
-        self.update_state(state='PROGRESS', meta={'current': 3, 'total': 6, 'status': 'Filtering by root_app'})
+    Args:
+        base_path: Базовый путь, где находятся логи.
+        output_filename: Имя файла для сохранения.
+        output_base_path: Базовый путь для сохранения файла.
+        output_format: Формат результата из OUTPUT_FORMATS ('csv' - несжатый CSV).
 
+    Returns:
+        Словарь с результатом (путь к файлу или сообщение об ошибке).
+    """
+    task_id = self.request.id
+    logger.info(f"Task {task_id} started: process_events_to_file_task with base_path='{base_path}'")
+    logger.info(f"Output path: {os.path.join(output_base_path, output_filename)}")
+    format_error = check_output_format(self, output_format)
+    if format_error:
+        return format_error
+    self.update_state(state='PROGRESS', meta={'current': 0, 'total': 1, 'status': 'Reading JSON files'})
 
-        # --- ШАГ 4: ФИЛЬТРАЦИЯ ПО root_app ---
-        logger.info(f"Task {task_id}: Filtering by root_app...")
-        if 'root_app' in processed_df.columns:
-            processed_df = processed_df[processed_df['root_app'].notna() & (processed_df['root_app'] != '')].copy()
-        else:
-            logger.warning(f"Task {task_id}: Column 'root_app' not found after processing. Skipping root_app filtering.")
-
-        if processed_df.empty:
-            logger.info(f"Task {task_id}: No data remaining after filtering by root_app. Task finished.")
-            self.update_state(state='SUCCESS', meta={'current': 6, 'total': 6, 'status': 'Completed (no root_app data)'})
-            return {"status": "success", "message": "No data remaining after filtering by root_app."}
-
-        logger.info(f"Task {task_id}: Remaining {len(processed_df)} records after filtering by root_app.")
-        self.update_state(state='PROGRESS', meta={'current': 4, 'total': 6, 'status': 'Dropping columns'})
-
-        # --- ШАГ 5: УДАЛЕНИЕ НЕНУЖНЫХ СТОЛБЦОВ ---
-        logger.info(f"Task {task_id}: Dropping unnecessary columns...")
-        columns_to_drop = ['batch_id', 'related_file', 'log_record_counter', 'program_titles']
-        # Удаляем 'environment' и 'env_info' если они вдруг остались (не должны)
-        columns_to_drop.extend(['environment', 'env_info'])
-        processed_df = processed_df.drop(columns=columns_to_drop, errors='ignore').copy()
-        logger.info(f"Task {task_id}: Column dropping completed.")
-        self.update_state(state='PROGRESS', meta={'current': 5, 'total': 6, 'status': 'Saving to CSV'})
-
-        # --- ШАГ 6: СОХРАНЕНИЕ В CSV ---
+    try:
+        # --- ШАГ 1: ЧТЕНИЕ JSON ФАЙЛОВ В ARROW ТАБЛИЦУ ---
+        events_table = parse_json_files_to_table(base_path)
+        logger.info(f"Task {task_id}: Finished reading JSON files. Got {events_table.num_rows} rows.")
+
+        if events_table.num_rows == 0:
+            logger.info(f"Task {task_id}: Input table is empty. Nothing to process.")
+            self.update_state(state='SUCCESS', meta={'current': 1, 'total': 1, 'status': 'Completed (empty input)'})
+            return {"status": "success", "message": "Input data was empty, nothing processed."}
+
+        # --- ШАГ 2: ПОТОКОВАЯ ОБРАБОТКА И СОХРАНЕНИЕ ---
+        # Столбцы из COLUMNS_TO_DROP не переносим в pandas.
+        # to_batches не склеивает куски (по куску на JSON файл), поэтому сначала combine_chunks
+        needed_columns = [name for name in events_table.column_names if name not in COLUMNS_TO_DROP]
+        batches = events_table.select(needed_columns).combine_chunks().to_batches(max_chunksize=ENV_BATCH_SIZE)
+        del events_table
         output_full_path = os.path.join(output_base_path, output_filename)
-        logger.info(f"Task {task_id}: Saving processed data to CSV: {output_full_path}...")
-        saved_file_path = save_to_csv(processed_df, output_filename, output_base_path)
-
-        if saved_file_path:
-            logger.info(f"Task {task_id}: Successfully saved to {saved_file_path}")
-            self.update_state(state='SUCCESS', meta={'current': 6, 'total': 6, 'status': 'Completed'})
-            return {"status": "success", "message": "Data processed and saved successfully", "file_path": saved_file_path}
-        else:
-            error_msg = "Failed to save CSV file."
-            logger.error(f"Task {task_id}: {error_msg}")
-            self.update_state(state='FAILURE', meta={'error': error_msg})
-            return {"status": "error", "message": error_msg}
+        logger.info(f"Task {task_id}: Processing {len(batches)} batches and saving ({output_format}) to {output_full_path}...")
+        rows_written = process_environment_batches(
+            batches, len(batches), output_full_path, output_format, task_id, report_batch_progress(self),
+        )
+        return finish_processing(self, rows_written, len(batches), output_full_path)
 
     except Exception as e:
         error_msg = f"An unexpected error occurred during task execution: {e}"
         logger.error(f"Task {task_id}: {error_msg}", exc_info=True)
         self.update_state(state='FAILURE', meta={'error': error_msg})
-        # Не переподнимаем исключение, так как возвращаем словарь ошибки
         return {"status": "error", "message": error_msg}
 
 # ... другие задачи (если есть)
\ No newline at end of file
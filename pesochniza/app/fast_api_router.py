@@ -14,16 +14,13 @@ from app.core.celery import celery # Ваш настроенный Celery инс
 from app.schemas.response_schema import IPostResponseBase, create_response # Ваши модели ответа
 from app.api.celery_task import ( # Импортируем нужные задачи и константы
     process_event_logs_to_dataframe_task,
-    process_environment_batch_task,
+    process_events_to_file_task,
     TEMP_DIR # Если TEMP_DIR используется в роутере (например, для информации)
 )
 
 # Импорт для Pydantic моделей запросов
 from pydantic import BaseModel
 
-# Импортируем chain для создания цепочек Celery
-from celery import chain
-
 # --- Настройка ---
 
 # Настройка логирования (лучше использовать общий логгер приложения)
@@ -127,9 +124,9 @@ async def start_environment_processing_workflow(
     request: ProcessJsonRequest = Body(...), # Используем ту же модель, если нужно
 ) -> IPostResponseBase:
     """
-    Starts the Celery workflow (chain) to parse logs from a base path,
-    extract environment data, and save it to a CSV file.
-    Returns the root task ID of the chain.
+    Starts the Celery workflow task to parse logs from a base path,
+    extract environment data, and save it to a zstd-compressed Feather file.
+    Returns the task ID.
     """
     base_path = request.base_path
     logger.info(f"API endpoint hit: /processing/start-environment-workflow with base_path='{base_path}'")
@@ -138,41 +135,22 @@ async def start_environment_processing_workflow(
     # Важно: output_base_path должен быть доступен для ЗАПИСИ для Celery воркеров.
     # Этот путь внутри контейнера/системы, где работают воркеры.
     output_base_path = '/app/processed_data' # Пример пути внутри контейнера
-    output_filename = 'processed_environment_data.csv'
+    output_filename = 'processed_environment_data.feather'
     expected_output_full_path = os.path.join(output_base_path, output_filename)
 
 
-    # --- Создание и запуск цепочки Celery ---
-    logger.info("Creating Celery chain for environment processing workflow.")
-
-    # 1. process_event_logs_to_dataframe_task.s(base_path):
-    #    Сигнатура первой задачи. base_path передается как позиционный аргумент.
-    #    Эта задача вернет путь к временному файлу (как результат).
-    first_task_signature = process_event_logs_to_dataframe_task.s(base_path)
-
-    # 2. process_environment_batch_task.s(output_filename=..., output_base_path=...):
-    #    Сигнатура второй задачи. output_filename и output_base_path передаются как именованные аргументы.
-    #    Celery автоматически передаст РЕЗУЛЬТАТ ПЕРВОЙ задачи (путь к временному файлу)
-    #    как ПЕРВЫЙ ПОЗИЦИОННЫЙ аргумент этой второй задаче (аргумент input_file_path).
-    second_task_signature = process_environment_batch_task.s(
-        output_filename=output_filename,
-        output_base_path=output_base_path
-    )
-
-    # Связываем задачи в цепочку: (task1 | task2)
-    workflow_chain = chain(first_task_signature, second_task_signature)
-
-    # Запускаем цепочку асинхронно
-    # .apply_async() предпочтительнее .delay() для цепочек и более сложной настройки
-    result = workflow_chain.apply_async()
+    # --- Запуск задачи Celery ---
+    # Весь workflow выполняется одной задачей: без промежуточного файла в TEMP_DIR,
+    # второго прохода через брокер и записи промежуточного результата в backend.
+    result = process_events_to_file_task.delay(base_path, output_filename, output_base_path)
 
-    logger.info(f"Celery workflow chain started. Root Task ID: {result.id}")
+    logger.info(f"Celery task 'process_events_to_file_task' started. Task ID: {result.id}")
 
     # Возвращаем немедленный ответ клиенту
     return create_response(
         message="Environment data processing workflow has been initiated.",
         data={
-            "root_task_id": result.id, # Возвращаем ID корневой задачи цепочки
+            "root_task_id": result.id, # ID задачи (имя поля сохранено для совместимости клиентов)
             "output_expected_path": expected_output_full_path # Возвращаем ожидаемый путь к результату
         }
     )
@@ -1,8 +1,17 @@
 # app/models/event_models.py
+import logging
 from dataclasses import dataclass
+from operator import attrgetter
 from typing import List, Any, Dict # Добавляем Dict для to_dict
 
-@dataclass
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+
+# slots=True (Python 3.10+): у объектов нет __dict__, поэтому при разборе
+# большого числа событий в fallback-пути они занимают меньше памяти
+@dataclass(slots=True)
 class BaseEvent:
     id: int
     batch_id: int
@@ -18,29 +27,62 @@ class BaseEvent:
     @staticmethod
     def from_dict(obj: Any) -> 'BaseEvent':
         try:
-            # Используем .get с дефолтным значением для безопасности
-            _id = int(obj.get("id", -1)) # Default to -1 or some indicator of missing
-            _batch_id = int(obj.get("batch_id", -1))
-            _user_id = str(obj.get("user_id", ""))
-            _timestamp = str(obj.get("timestamp", ""))
-            _event_type = str(obj.get("event_type", ""))
-            _record_id = str(obj.get("record_id", ""))
-            _related_file = str(obj.get("related_file", ""))
-            _log_record_counter = int(obj.get("log_record_counter", -1))
-            _event_context = str(obj.get("event_context", ""))
-            _environment = str(obj.get("environment", ""))
-            return BaseEvent(_id, _batch_id, _user_id, _timestamp, _event_type, _record_id, _related_file, _log_record_counter, _event_context, _environment)
+            # Используем .get с дефолтным значением для безопасности.
+            # Метод и конструктор берутся в локальные имена, а объект создается одним вызовом
+            # без промежуточных переменных: метод вызывается на каждое событие файла
+            get = obj.get
+            return BaseEvent(
+                int(get("id", -1)), # Default to -1 or some indicator of missing
+                int(get("batch_id", -1)),
+                str(get("user_id", "")),
+                str(get("timestamp", "")),
+                str(get("event_type", "")),
+                str(get("record_id", "")),
+                str(get("related_file", "")),
+                int(get("log_record_counter", -1)),
+                str(get("event_context", "")),
+                str(get("environment", "")),
+            )
         except (ValueError, TypeError) as e:
             # Логируем ошибку и поднимаем исключение, чтобы задача Celery провалилась
-            print(f"Error parsing BaseEvent from dict: {obj}. Error: {e}")
+            logger.error(f"Error parsing BaseEvent from dict: {obj}. Error: {e}")
             raise ValueError(f"Could not parse BaseEvent from dict: {obj}") from e
 
     def to_dict(self) -> Dict[str, Any]:
-        """Преобразует объект BaseEvent в словарь."""
-        return self.__dict__
+        """Преобразует объект BaseEvent в новый словарь (не ссылку на __dict__)."""
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+    @staticmethod
+    def to_columns(events: List['BaseEvent']) -> Dict[str, List[Any]]:
+        """
+        Раскладывает события по столбцам: {имя поля: список значений}.
+        Таблица из столбцов строится без словаря на каждое событие.
+        """
+        return {name: list(map(attrgetter(name), events)) for name in BaseEvent.__dataclass_fields__}
+
+
+# Arrow-схема колонок BaseEvent: по ней JSON читается сразу в таблицу,
+# без создания объекта BaseEvent на каждое событие.
+EVENT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("batch_id", pa.int64()),
+    ("user_id", pa.string()),
+    ("timestamp", pa.string()),
+    ("event_type", pa.string()),
+    ("record_id", pa.string()),
+    ("related_file", pa.string()),
+    ("log_record_counter", pa.int64()),
+    ("event_context", pa.string()),
+    ("environment", pa.string()),
+])
+
+# Схема верхнего уровня JSON файла (audio_events не нужны и игнорируются)
+EVENT_FILE_SCHEMA = pa.schema([
+    ("base_events", pa.list_(pa.struct(list(EVENT_SCHEMA)))),
+])
 
 
-@dataclass
+@dataclass(slots=True)
 class AudioEvent:
      # Определите поля AudioEvent здесь, если они есть в вашем JSON.
      # Если AudioEvent может быть пустым объектом или не имеет критически важных полей
@@ -58,15 +100,15 @@ class AudioEvent:
              # ... парсинг других полей AudioEvent
              return AudioEvent(_id) # Верните объект с распарсенными полями
          except (ValueError, TypeError) as e:
-             print(f"Error parsing AudioEvent from dict: {obj}. Error: {e}")
+             logger.error(f"Error parsing AudioEvent from dict: {obj}. Error: {e}")
              raise ValueError(f"Could not parse AudioEvent from dict: {obj}") from e
 
      def to_dict(self) -> Dict[str, Any]:
-         """Преобразует объект AudioEvent в словарь."""
-         return self.__dict__
+         """Преобразует объект AudioEvent в новый словарь (не ссылку на __dict__)."""
+         return {name: getattr(self, name) for name in self.__dataclass_fields__}
 
 
-@dataclass
+@dataclass(slots=True)
 class Root:
     base_events: List[BaseEvent]
     audio_events: List[AudioEvent]
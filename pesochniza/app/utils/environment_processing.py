@@ -1,26 +1,93 @@
 # app/utils/environment_processing.py
 
+import functools
 import json
+import logging
 import re
 import os
 from urllib.parse import urlparse
+import orjson
 import pandas as pd # Добавляем импорт pandas, т.к. extract_environment_info использует dicts, которые pandas.Series может обрабатывать
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
 
 # --- Константы ---
 SEPARATORS = ['::', ' - ', ' | ', ' — ', ' – ']
-URL_PATTERN = r'https?://[^\s]+|www\.[^\s]+|[^\s]+\.(com|ru|org|net|edu|gov|io)[^\s]*'
+# Третья альтернатива начинается только с начала слова ((?<!\S)): иначе поиск пробует
+# каждую позицию длинного слова без домена и работает за квадратичное время.
+# Совпадения те же, что и у прежнего [^\s]+\.(com|...)[^\s]* - слово целиком.
+URL_PATTERN = r'https?://\S+|www\.\S+|(?<!\S)\S+?\.(?:com|ru|org|net|edu|gov|io)\S*'
 BROWSER_INDICATORS = {
     'Chrome_WidgetWin_1': 'Google Chrome',
     'MozillaWindowClass': 'Firefox',
     'Edge': 'Microsoft Edge',
 }
+# (индикатор, он же в нижнем регистре, браузер): нижний регистр считается один раз при импорте
+_BROWSER_INDICATOR_ITEMS = tuple(
+    (indicator, indicator.lower(), app_name) for indicator, app_name in BROWSER_INDICATORS.items()
+)
 BROWSER_NAMES = [
     'Google Chrome', 'Chrome', 'Firefox', 'Mozilla Firefox',
     'Microsoft Edge', 'Edge', 'Safari', 'Opera'
 ]
 
+# Регулярные выражения компилируются один раз при импорте: функции ниже вызываются
+# для каждого окна каждого события, а re.sub/re.search со строкой-шаблоном
+# на каждом вызове заново ищут шаблон в кэше модуля re
+_URL_RE = re.compile(URL_PATTERN, re.IGNORECASE)
+_WWW_RE = re.compile(r'^www\.', re.IGNORECASE)
+_QUERY_RE = re.compile(r'\?.*$')
+_EXT_SHORT_RE = re.compile(r'\.(exe|bat|dll)$', re.IGNORECASE)
+# Расширения, которые отрезаются от имени файла в заголовке окна (проверка через endswith без regex)
+_EXT_SUFFIXES = (
+    '.exe', '.bat', '.dll', '.py', '.sh', '.txt', '.doc', '.docx', '.pdf', '.xlsx', '.pptx',
+    '.jpg', '.png', '.gif', '.mp4', '.mp3', '.zip', '.rar', '.7z',
+)
+# Класс символов-разделителей (из SEPARATORS) для шаблонов remove_browser_names
+_SEP_CLASS = re.escape("".join(SEPARATORS))
+_DOUBLE_SEP_RE = re.compile(rf'[{_SEP_CLASS}]\s*[{_SEP_CLASS}]')
+# Символы разделителей и все пробельные символы (те же, что \s в re): str.strip с ними
+# убирает разделители и пробелы по краям строки без regex
+_SEP_STRIP_CHARS = ''.join(set(''.join(SEPARATORS))) + ''.join(ch for ch in map(chr, range(0x3001)) if ch.isspace())
+# Последний (самый правый) разделитель из SEPARATORS: жадное .* доходит до конца строки
+# и откатывается назад до первого совпадения - один проход вместо rfind по каждому разделителю
+_LAST_SEP_RE = re.compile('.*(' + '|'.join(re.escape(sep) for sep in SEPARATORS) + ')', re.DOTALL)
+
+# Поля словаря окна, который возвращает extract_environment_info, и их типы.
+# Явные типы нужны, чтобы результат, собранный по частям, имел одинаковую схему
+# (например, в части, где у всех окон window_left = None).
+WINDOW_SCHEMA = pa.schema([
+    ('program_title', pa.string()),
+    ('root_app', pa.string()),
+    ('tab_title', pa.string()),
+    ('classname', pa.string()),
+    ('process_path', pa.string()),
+    ('is_active', pa.bool_()),
+    ('z_index', pa.int64()),
+    # Координаты окна и мыши бывают дробными (масштабирование DPI), поэтому float64:
+    # целочисленный столбец молча отбросил бы дробную часть
+    ('window_left', pa.float64()),
+    ('window_top', pa.float64()),
+    ('window_right', pa.float64()),
+    ('window_bottom', pa.float64()),
+    ('mouse_x', pa.float64()),
+    ('mouse_y', pa.float64()),
+    ('modifiers', pa.int64()),
+    ('timestamp', pa.string()),
+])
+# Порядок полей в кортеже окна, который строит _extract_window_rows
+_WINDOW_COLS = tuple(WINDOW_SCHEMA.names)
+# Границы int64: значения вне их не помещаются в целочисленные столбцы WINDOW_SCHEMA
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
 # --- Вспомогательные функции ---
 
+# Заголовки окон и пути процессов от события к событию почти не меняются,
+# поэтому результаты чистых функций очистки ниже кэшируются (LRU ограничивает память)
+_CLEAN_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=_CLEAN_CACHE_SIZE)
 def clean_and_shorten_url(url):
     """
     Очищает и сокращает URL, оставляя только домен и основную часть пути.
@@ -34,7 +101,7 @@ def clean_and_shorten_url(url):
         path_parts = parsed_url.path.split('/')
         short_path = '/'.join(path_parts[:3]) if path_parts else ''
         if domain:
-            domain = re.sub(r'^www\.', '', domain, flags=re.IGNORECASE)
+            domain = _WWW_RE.sub('', domain)
             if short_path and short_path != '/':
                 return f"{domain}{short_path[:50]}"
             return domain
@@ -42,28 +109,59 @@ def clean_and_shorten_url(url):
     except:
         return url
 
-def clean_and_shorten(text, is_url=False):
+def _cleanup_paths(text):
+    """
+    Сокращает путь (с '/' или '\\') до двух последних частей.
+    """
+    if '\\' in text or '/' in text:
+        # Нужны только две последние части, поэтому строка режется не целиком, а с конца
+        parts = text.replace('\\', '/').rsplit('/', 2)
+        if len(parts) > 2 or parts[0] != '':
+             text = '/'.join(parts[-2:])
+
+    return text
+
+def _shorten_url_fast(text):
+    """
+    Очищает и сокращает строку, которая заведомо считается URL (без проверки URL_PATTERN).
+    """
+    if not text:
+        return ''
+    return clean_and_shorten_url(text.strip())
+
+@functools.lru_cache(maxsize=_CLEAN_CACHE_SIZE)
+def _shorten_text_fast(text):
     """
-    Очищает строку от URL и сокращает её, удаляя лишние детали.
+    Очищает и сокращает произвольную строку: URL сокращается, путь - до двух последних частей.
     """
     if not text:
         return ''
 
     cleaned_text = text.strip()
 
-    if is_url or re.search(URL_PATTERN, cleaned_text, flags=re.IGNORECASE):
+    # URL_PATTERN может совпасть, только если в строке есть '.' или '://':
+    # остальные строки (большинство заголовков) не доходят до regex
+    if ('.' in cleaned_text or '://' in cleaned_text) and _URL_RE.search(cleaned_text):
          return clean_and_shorten_url(cleaned_text)
 
-    cleaned_text = re.sub(URL_PATTERN, '', cleaned_text, flags=re.IGNORECASE)
-    cleaned_text = re.sub(r'\?.*$', '', cleaned_text)
-    cleaned_text = cleaned_text.strip()
+    # Раз URL_PATTERN не нашелся, удалять URL из строки не нужно.
+    # Строка уже без пробелов по краям, а хвост с '?' убирается только справа
+    if '?' in cleaned_text:
+        cleaned_text = _QUERY_RE.sub('', cleaned_text).rstrip()
+
+    return _cleanup_paths(cleaned_text)
 
-    if '\\' in cleaned_text or '/' in cleaned_text:
-        parts = cleaned_text.replace('\\', '/').split('/')
-        if len(parts) > 2 or (len(parts) == 2 and parts[0] != ''):
-             cleaned_text = '/'.join(parts[-2:])
+def _compile_browser_name_patterns(browser_names):
+    """
+    Компилирует шаблоны названия браузера в конце строки и между разделителями.
+    """
+    alternation = "|".join(re.escape(name) for name in browser_names)
+    tail_re = re.compile(rf'\s*[{_SEP_CLASS}\s]*({alternation})$', re.IGNORECASE)
+    middle_re = re.compile(rf'[{_SEP_CLASS}]\s*({alternation})\s*[{_SEP_CLASS}]', re.IGNORECASE)
+    return tail_re, middle_re
 
-    return cleaned_text
+# BROWSER_NAMES не меняется, поэтому шаблоны для него строятся один раз
+_BROWSER_TAIL_RE, _BROWSER_MIDDLE_RE = _compile_browser_name_patterns(BROWSER_NAMES)
 
 def remove_browser_names(text, browser_names):
     """
@@ -72,30 +170,98 @@ def remove_browser_names(text, browser_names):
     if not text:
         return ''
 
-    cleaned_text = text
-    browser_patterns = [re.escape(name) for name in browser_names]
-    pattern = rf'\s*[{re.escape("".join(SEPARATORS))}\s]*({"|".join(browser_patterns)})$'
-    cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE).strip()
+    if browser_names is BROWSER_NAMES:
+        return _remove_known_browser_names(text)
+    return _strip_browser_names(text, *_compile_browser_name_patterns(browser_names))
 
-    pattern_middle = rf'[{re.escape("".join(SEPARATORS))}]\s*({"|".join(browser_patterns)})\s*[{re.escape("".join(SEPARATORS))}]'
-    cleaned_text = re.sub(pattern_middle, ' - ', cleaned_text, flags=re.IGNORECASE).strip()
+@functools.lru_cache(maxsize=_CLEAN_CACHE_SIZE)
+def _remove_known_browser_names(text):
+    """
+    remove_browser_names для BROWSER_NAMES (список не хешируется, поэтому кэш - по тексту).
+    """
+    return _strip_browser_names(text, _BROWSER_TAIL_RE, _BROWSER_MIDDLE_RE)
 
-    cleaned_text = re.sub(rf'[{re.escape("".join(SEPARATORS))}]\s*[{re.escape("".join(SEPARATORS))}]', ' - ', cleaned_text).strip()
-    cleaned_text = re.sub(rf'^[{re.escape("".join(SEPARATORS))}\s]+', '', cleaned_text).strip()
-    cleaned_text = re.sub(rf'[{re.escape("".join(SEPARATORS))}\s]+$', '', cleaned_text).strip()
+def _strip_browser_names(text, tail_re, middle_re):
+    # strip перед middle_re нужен: иначе пробел на краю считается разделителем.
+    # Дальше пробелы по краям входят в крайние серии разделителей,
+    # которые в конце целиком убирает strip(_SEP_STRIP_CHARS)
+    cleaned_text = tail_re.sub('', text).strip()
+    cleaned_text = middle_re.sub(' - ', cleaned_text)
+    cleaned_text = _DOUBLE_SEP_RE.sub(' - ', cleaned_text)
 
-    return cleaned_text.strip()
+    return cleaned_text.strip(_SEP_STRIP_CHARS)
 
-def extract_environment_info(environment_str: str):
+# При сборке пачки в extract_environment_info_batch значения полей окна приводятся
+# к типам WINDOW_SCHEMA по одному: значение неожиданного типа становится None (null)
+# только в своем поле, а не роняет сборку всей пачки в pa.array
+
+def _as_int(value):
+    """
+    Значение для целочисленного поля (z_index, modifiers): int (или float с целым значением)
+    в пределах int64, иначе None. Дробные числа не округляются, чтобы не терять данные молча.
+    """
+    if type(value) is int:
+        return value if _INT64_MIN <= value <= _INT64_MAX else None
+    if isinstance(value, float) and value.is_integer():
+        return _as_int(int(value))
+    if isinstance(value, int): # bool
+        return int(value)
+    return None
+
+def _as_float(value):
+    """
+    Значение для поля с плавающей точкой (координаты): любое число, иначе None.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+def _as_bool(value):
+    """
+    Значение для логического поля: bool как есть, 0/1 - как False/True, иначе None.
+    """
+    if isinstance(value, bool):
+        return value
+    if type(value) is int and value in (0, 1):
+        return bool(value)
+    return None
+
+def _as_str(value):
+    """
+    Значение для строкового поля: строка как есть, число - его запись строкой, иначе None.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    return None
+
+# Поля окна, которые нужно приводить к типу столбца (остальные поля - строки,
+# которые _extract_window_rows строит сам)
+_WINDOW_CONVERTERS = {
+    'is_active': _as_bool,
+    'z_index': _as_int,
+    'window_left': _as_float,
+    'window_top': _as_float,
+    'window_right': _as_float,
+    'window_bottom': _as_float,
+    'mouse_x': _as_float,
+    'mouse_y': _as_float,
+    'modifiers': _as_int,
+    'timestamp': _as_str,
+}
+
+def _extract_window_rows(environment_str: str, row_id=None):
     """
     Извлекает информацию из строки environment.
-    Возвращает список словарей с информацией об окнах или None при ошибке.
+    Возвращает список кортежей окон (поля в порядке _WINDOW_COLS, последним - row_id)
+    или None при ошибке.
     """
     if not isinstance(environment_str, str) or not environment_str.strip():
         return []
 
     try:
-        environment_data = json.loads(environment_str)
+        environment_data = orjson.loads(environment_str) # разбор в C, заметно быстрее json.loads
         results = []
 
         mouse_x = environment_data.get('mouse_x', None)
@@ -119,8 +285,9 @@ def extract_environment_info(environment_str: str):
                     is_browser = False
 
                     detected_browser_name = None
-                    for indicator, app_name in BROWSER_INDICATORS.items():
-                        if indicator in classname or (process_path and indicator.lower() in process_path.lower()):
+                    process_path_lower = process_path.lower() # один раз на окно, а не на каждый индикатор
+                    for indicator, indicator_lower, app_name in _BROWSER_INDICATOR_ITEMS:
+                        if indicator in classname or indicator_lower in process_path_lower:
                             is_browser = True
                             detected_browser_name = app_name
                             break
@@ -128,88 +295,114 @@ def extract_environment_info(environment_str: str):
                     if is_browser:
                         root_app = detected_browser_name or 'Браузер'
                         cleaned_title = remove_browser_names(program_title, BROWSER_NAMES)
-                        tab_title = clean_and_shorten(cleaned_title, is_url=True)
+                        tab_title = _shorten_url_fast(cleaned_title)
                     else:
                         if '\\' in program_title or '/' in program_title:
-                            file_name = os.path.basename(program_title)
-                            specific_part = re.sub(r'\.(exe|bat|dll|py|sh|txt|doc|docx|pdf|xlsx|pptx|jpg|png|gif|mp4|mp3|zip|rar|7z)$', '', file_name, flags=re.IGNORECASE).strip()
-                            dir_path = os.path.dirname(program_title)
+                            # Один rpartition вместо os.path.basename + os.path.dirname (с теми же
+                            # результатами: разделитель - '/', хвостовые '/' у директории убираются)
+                            head, slash, file_name = program_title.rpartition('/')
+                            dir_path = head.rstrip('/') or head + slash
+
+                            specific_part = file_name
+                            file_name_lower = file_name.lower()
+                            for suffix in _EXT_SUFFIXES:
+                                if file_name_lower.endswith(suffix):
+                                    specific_part = file_name[:-len(suffix)]
+                                    break
+                            specific_part = specific_part.strip()
 
                             root_app_candidate = dir_path or file_name
-                            root_app = clean_and_shorten(root_app_candidate, is_url=False)
+                            root_app = _shorten_text_fast(root_app_candidate)
 
                             tab_title = specific_part if specific_part else ''
                         else:
-                            last_separator = None
-                            last_pos = -1
-                            for sep in SEPARATORS:
-                                pos = program_title.rfind(sep)
-                                if pos > last_pos:
-                                    last_pos = pos
-                                    last_separator = sep
-
-                            if last_separator and last_pos > 0:
-                                tab_title_candidate = program_title[:last_pos].strip()
-                                root_app_candidate = program_title[last_pos + len(last_separator):].strip()
-
-                                root_app = clean_and_shorten(root_app_candidate)
-                                tab_title = clean_and_shorten(tab_title_candidate)
+                            last_separator_match = _LAST_SEP_RE.match(program_title)
+                            last_pos = last_separator_match.start(1) if last_separator_match else -1
+
+                            if last_pos > 0:
+                                # strip не нужен: _shorten_text_fast сам убирает пробелы по краям
+                                tab_title_candidate = program_title[:last_pos]
+                                root_app_candidate = program_title[last_separator_match.end(1):]
+
+                                root_app = _shorten_text_fast(root_app_candidate)
+                                tab_title = _shorten_text_fast(tab_title_candidate)
                             else:
-                                root_app = clean_and_shorten(program_title)
+                                root_app = _shorten_text_fast(program_title)
                                 tab_title = ''
 
-                    cleaned_process_path = clean_and_shorten(process_path, is_url=False)
+                    cleaned_process_path = _shorten_text_fast(process_path)
 
                     if not root_app and cleaned_process_path:
                          root_app = os.path.basename(cleaned_process_path)
-                         root_app = re.sub(r'\.(exe|bat|dll)$', '', root_app, flags=re.IGNORECASE).strip()
+                         root_app = _EXT_SHORT_RE.sub('', root_app).strip()
                          if not root_app and classname:
                               root_app = classname
 
-                    result = {
-                        'program_title': program_title,
-                        'root_app': root_app or 'Неизвестно',
-                        'tab_title': tab_title,
-                        'classname': classname,
-                        'process_path': cleaned_process_path,
-                        'is_active': is_active,
-                        'z_index': z_index,
-                        'window_left': window.get('window_left', None),
-                        'window_top': window.get('window_top', None),
-                        'window_right': window.get('window_right', None),
-                        'window_bottom': window.get('window_bottom', None),
-                        'mouse_x': mouse_x,
-                        'mouse_y': mouse_y,
-                        'modifiers': modifiers,
-                        'timestamp': timestamp,
+                    # Кортеж вместо словаря: не нужно хешировать 15 ключей на каждое окно,
+                    # а столбцы потом собираются транспонированием списка кортежей
+                    results.append((
+                        program_title,
+                        root_app or 'Неизвестно',
+                        tab_title,
+                        classname,
+                        cleaned_process_path,
+                        is_active,
+                        z_index,
+                        window.get('window_left', None),
+                        window.get('window_top', None),
+                        window.get('window_right', None),
+                        window.get('window_bottom', None),
+                        mouse_x,
+                        mouse_y,
+                        modifiers,
+                        timestamp,
                         # Добавьте другие поля из env_info, если они нужны на уровне окна после explode
-                        # Например, ID пользователя, ID события и т.п.
-                        # Для этого вам нужно будет передать их в эту функцию или объединить позже
-                        # Пока предполагаем, что эти поля будут в DataFrame до explode
-                    }
-                    results.append(result)
+                        # (и соответствующие поля в WINDOW_SCHEMA)
+                        # Номер исходного события: разворачивание (explode) происходит прямо здесь
+                        row_id,
+                    ))
         return results
 
-    except json.JSONDecodeError:
-        print(f"Ошибка парсинга JSON: {environment_str[:200]}...")
+    except json.JSONDecodeError: # orjson.JSONDecodeError - подкласс json.JSONDecodeError
+        logger.warning(f"Ошибка парсинга JSON: {environment_str[:200]}...")
         return None
     except Exception as e:
-        print(f"Неожиданная ошибка при обработке environment: {e}")
-        print(f"Проблемная строка: {environment_str[:200]}...")
+        logger.error(f"Неожиданная ошибка при обработке environment: {e}. Проблемная строка: {environment_str[:200]}...")
         return None
-def save_to_csv(df: pd.DataFrame, filename: str, base_path: str):
+
+def extract_environment_info(environment_str: str):
+    """
+    Извлекает информацию из строки environment.
+    Возвращает список словарей с информацией об окнах или None при ошибке.
     """
-    Сохраняет DataFrame в CSV файл на Google Диске.
+    rows = _extract_window_rows(environment_str)
+    if rows is None:
+        return None
+    # row_id в конце кортежа в словарь не попадает
+    return [dict(zip(_WINDOW_COLS, row[:-1], strict=True)) for row in rows]
 
-    Args:
-        df: DataFrame для сохранения.
-        filename: Имя файла для сохранения.
-        base_path: Путь к папке на Google Диске, куда нужно сохранить файл.
+def extract_environment_info_batch(environments: pd.Series) -> pd.DataFrame:
     """
-    full_path = os.path.join(base_path, filename)  # Полный путь к файлу
-    try:
-        df.to_csv(full_path, index=False)  # index=False чтобы не сохранять индексы строк
-        print(f"DataFrame успешно сохранен в файл: {full_path}")
-    except Exception as e:
-        print(f"Ошибка при сохранении файла: {e}")
-save_to_csv(data, "data2.csv", base_path)
\ No newline at end of file
+    Применяет extract_environment_info ко всему столбцу environment.
+    Возвращает плоскую таблицу окон (по строке на окно, как после explode):
+    индекс - индекс исходного события, столбцы и типы - из WINDOW_SCHEMA.
+    Пустые значения и ошибки парсинга не дают ни одной строки.
+    """
+    rows = []
+    for row_id, environment_str in zip(environments.index, environments.to_numpy(dtype=object)):
+        env_rows = _extract_window_rows(environment_str, row_id)
+        if env_rows:
+            rows += env_rows
+
+    # Список кортежей транспонируется в столбцы (zip в C), каждый столбец
+    # сразу получает тип из WINDOW_SCHEMA, без вывода схемы по строкам.
+    # Последний столбец - номера исходных событий (индекс результата)
+    *columns, row_ids = zip(*rows) if rows else [()] * (len(WINDOW_SCHEMA) + 1)
+    arrays = []
+    for column, field in zip(columns, WINDOW_SCHEMA, strict=True):
+        converter = _WINDOW_CONVERTERS.get(field.name)
+        arrays.append(pa.array(column if converter is None else list(map(converter, column)), type=field.type))
+    windows_table = pa.Table.from_arrays(arrays, schema=WINDOW_SCHEMA)
+    windows_df = windows_table.to_pandas(types_mapper=pd.ArrowDtype)
+    windows_df.index = pd.Index(row_ids, dtype=environments.index.dtype)
+    return windows_df
@@ -0,0 +1,29 @@
+"""
+Тесты модулей pesochniza/app.
+
+Модули pesochniza/app ложатся поверх пакета app бэкенда и импортируются как app.*,
+поэтому здесь пакет app собирается из pesochniza/app. app.core.celery - отдельное
+приложение Celery без брокера и result backend: задачам нужен только декоратор
+celery.task, а настройки бэкенда (БД, Redis) тестам не нужны.
+
+Запуск из корня репозитория (отдельно от backend/app/test, где app - пакет бэкенда):
+    python -m pytest pesochniza/test
+"""
+import sys
+import types
+from pathlib import Path
+
+from celery import Celery
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+
+app_package = types.ModuleType("app")
+app_package.__path__ = [str(APP_DIR)]
+core_package = types.ModuleType("app.core")
+core_package.__path__ = []
+celery_module = types.ModuleType("app.core.celery")
+celery_module.celery = Celery("pesochniza_test")
+
+app_package.core = core_package
+core_package.celery = celery_module
+sys.modules.update({"app": app_package, "app.core": core_package, "app.core.celery": celery_module})
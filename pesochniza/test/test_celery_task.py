@@ -0,0 +1,173 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.api.celery_task import (
+    COLUMNS_TO_DROP,
+    DICTIONARY_COLUMNS,
+    OUTPUT_FORMATS,
+    OUTPUT_SCHEMA,
+    ProcessedDataWriter,
+    process_environment_batches,
+    transform_environment_data,
+)
+from app.models.event_models import EVENT_SCHEMA
+from app.utils.environment_processing import WINDOW_SCHEMA, extract_environment_info
+
+
+def window(program_title, z_index=0):
+    return {
+        "program_title": program_title,
+        "classname": "OpusApp",
+        "process_path": "C:/Office/WINWORD.EXE",
+        "is_active": z_index == 0,
+        "z_index": z_index,
+        "window_left": 0,
+        "window_top": 0,
+        "window_right": 800,
+        "window_bottom": 600,
+    }
+
+
+def environment(*windows):
+    return json.dumps({"mouse_x": 1, "mouse_y": 2, "modifiers": 0, "timestamp": "t-env", "log_windows": list(windows)})
+
+
+def event(event_id, environment_str):
+    return {
+        "id": event_id,
+        "batch_id": 1,
+        "user_id": f"user-{event_id}",
+        "timestamp": f"t-{event_id}",
+        "event_type": "window",
+        "record_id": f"rec-{event_id}",
+        "related_file": "",
+        "log_record_counter": event_id,
+        "event_context": "",
+        "environment": environment_str,
+    }
+
+
+def events_batch(events):
+    needed_columns = [name for name in EVENT_SCHEMA.names if name not in COLUMNS_TO_DROP]
+    table = pa.Table.from_pylist(events, schema=EVENT_SCHEMA).select(needed_columns)
+    return table.to_batches()[0]
+
+
+def test_transform_environment_data():
+    events = [
+        event(1, environment(window("a.docx - Word", 1), window("b.docx - Word", 0))),
+        event(2, ""),
+        event(3, "not json"),
+        event(4, environment(window("notes - Notepad"))),
+    ]
+
+    table = transform_environment_data(events_batch(events), task_id="test")
+
+    assert table.schema == OUTPUT_SCHEMA
+    event_names = OUTPUT_SCHEMA.names[:-len(WINDOW_SCHEMA)]
+    window_names = OUTPUT_SCHEMA.names[-len(WINDOW_SCHEMA):]  # env_timestamp вместо timestamp
+    expected = []
+    for source_event in events:
+        for window_info in extract_environment_info(source_event["environment"]) or []:
+            row = {name: source_event[name] for name in event_names}
+            row.update(zip(window_names, window_info.values(), strict=True))
+            expected.append(row)
+    assert table.to_pylist() == expected
+    assert table.column("id").to_pylist() == [1, 1, 4]
+    assert table.column("env_timestamp").to_pylist() == ["t-env"] * 3
+
+
+def test_transform_environment_data_without_windows():
+    table = transform_environment_data(events_batch([event(1, ""), event(2, "not json")]), task_id="test")
+
+    assert table.num_rows == 0
+    assert table.schema == OUTPUT_SCHEMA
+
+
+def test_process_environment_batches(tmp_path):
+    batch = events_batch([event(1, environment(window("a.docx - Word"))), event(2, "")])
+    path = str(tmp_path / "result")
+    progress = []
+
+    rows_written = process_environment_batches([batch, batch], 2, path, "parquet.snappy", "test",
+                                               lambda done, total: progress.append((done, total)))
+
+    assert rows_written == 2
+    assert progress == [(1, 2), (2, 2)]
+    assert pq.read_table(path).cast(OUTPUT_SCHEMA).equals(
+        pa.concat_tables([transform_environment_data(batch, task_id="test")] * 2))
+
+
+def test_process_environment_batches_rejects_other_schema(tmp_path):
+    batch = events_batch([event(1, environment(window("a.docx - Word")))])
+    batch = batch.set_column(batch.schema.get_field_index("id"), "id", batch.column("id").cast(pa.string()))
+
+    with pytest.raises(ValueError, match="OUTPUT_SCHEMA"):
+        process_environment_batches([batch], 1, str(tmp_path / "result"), "parquet.snappy", "test",
+                                    lambda done, total: None)
+    assert os.listdir(tmp_path) == []
+
+
+def output_rows(start, users, root_apps):
+    rows = []
+    for offset, (user_id, root_app) in enumerate(zip(users, root_apps, strict=True)):
+        row = {field.name: None for field in OUTPUT_SCHEMA}
+        row.update(id=start + offset, user_id=user_id, event_type="window", root_app=root_app,
+                   program_title=f"title {start + offset}", is_active=bool(offset % 2), z_index=offset)
+        rows.append(row)
+    return pa.Table.from_pylist(rows, schema=OUTPUT_SCHEMA)
+
+
+def read_output(path, output_format):
+    if output_format.startswith("feather"):
+        with pa.ipc.open_file(path) as reader:
+            return reader.read_all()
+    return pq.read_table(path)
+
+
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_processed_data_writer_round_trip(tmp_path, output_format):
+    # Вторая и третья пачки добавляют новые значения словарных столбцов (дельты словаря)
+    tables = [
+        output_rows(0, ["user-1", "user-2", None], ["Word", "Word", "Excel"]),
+        output_rows(3, ["user-2", "user-3"], ["Google Chrome", "Word"]),
+        output_rows(5, ["user-4"], [None]),
+    ]
+    path = str(tmp_path / "result")
+    writer = ProcessedDataWriter(path, output_format)
+    for table in tables:
+        writer.write(table)
+    writer.close()
+
+    expected = pa.concat_tables(tables)
+    assert writer.rows_written == expected.num_rows
+    assert os.listdir(tmp_path) == ["result"]
+    if output_format == "csv":
+        with open(path) as f:
+            assert f.read() == expected.to_pandas(types_mapper=pd.ArrowDtype).to_csv(index=False)
+    else:
+        result = read_output(path, output_format)
+        for name in DICTIONARY_COLUMNS:
+            assert pa.types.is_dictionary(result.schema.field(name).type)
+        assert result.cast(OUTPUT_SCHEMA).equals(expected)
+
+
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_processed_data_writer_abort_leaves_no_file(tmp_path, output_format):
+    writer = ProcessedDataWriter(str(tmp_path / "result"), output_format)
+    writer.write(output_rows(0, ["user-1"], ["Word"]))
+    writer.abort()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_processed_data_writer_without_rows_creates_no_file(tmp_path):
+    writer = ProcessedDataWriter(str(tmp_path / "result"), "feather.zstd")
+    writer.close()
+
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,108 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from app.utils.environment_processing import (
+    WINDOW_SCHEMA,
+    extract_environment_info,
+    extract_environment_info_batch,
+)
+
+
+def window(**fields):
+    data = {
+        "program_title": "report.docx - Word",
+        "classname": "OpusApp",
+        "process_path": "C:\\Program Files\\Office\\WINWORD.EXE",
+        "is_active": True,
+        "z_index": 1,
+        "window_left": 0,
+        "window_top": 0,
+        "window_right": 1920,
+        "window_bottom": 1080,
+    }
+    data.update(fields)
+    return data
+
+
+def environment(windows, **fields):
+    data = {"mouse_x": 10, "mouse_y": 20, "modifiers": 0, "timestamp": "2024-01-01T00:00:00", "log_windows": windows}
+    data.update(fields)
+    return json.dumps(data)
+
+
+ENVIRONMENTS = [
+    environment([window(), window(program_title="Inbox - Gmail - Google Chrome", classname="Chrome_WidgetWin_1", z_index=2)]),
+    "",
+    None,
+    "not json",
+    json.dumps({"mouse_x": 1}),
+    environment([window(program_title="C:/Users/me/Documents/notes.txt", z_index=0)]),
+    environment([window(program_title="https://www.example.com/path/to/page?q=1", process_path="C:/Apps/firefox.exe")]),
+]
+
+
+def batch_rows(windows_df):
+    """Строки результата extract_environment_info_batch в виде списка словарей (null -> None)."""
+    return pa.Table.from_pandas(windows_df, preserve_index=False).to_pylist()
+
+
+def test_batch_matches_extract_environment_info():
+    environments = pd.Series(ENVIRONMENTS, index=range(10, 10 + len(ENVIRONMENTS)))
+
+    windows_df = extract_environment_info_batch(environments)
+
+    expected_rows = []
+    expected_index = []
+    for row_id, environment_str in environments.items():
+        for window_info in extract_environment_info(environment_str) or []:
+            expected_rows.append(window_info)
+            expected_index.append(row_id)
+
+    assert list(windows_df.columns) == WINDOW_SCHEMA.names
+    assert list(windows_df.index) == expected_index
+    assert batch_rows(windows_df) == expected_rows
+
+
+def test_batch_without_windows_keeps_schema():
+    windows_df = extract_environment_info_batch(pd.Series(["", "not json"], dtype=object))
+
+    assert windows_df.empty
+    assert pa.Schema.from_pandas(windows_df, preserve_index=False) == WINDOW_SCHEMA
+
+
+@pytest.mark.parametrize(
+    "environment_str, field, expected",
+    [
+        (environment([window()], timestamp=1700000000), "timestamp", "1700000000"),
+        (environment([window(is_active=1)]), "is_active", True),
+        (environment([window(is_active="yes")]), "is_active", None),
+        (environment([window()], modifiers="shift"), "modifiers", None),
+        (environment([window(window_left=1.5)]), "window_left", 1.5),
+        (environment([window()], mouse_x=10.5), "mouse_x", 10.5),
+        (environment([window(window_top="12")]), "window_top", None),
+        (environment([window(z_index=2.0)]), "z_index", 2),
+        (environment([window(z_index=1.5)]), "z_index", None),
+        (environment([window()], modifiers=2 ** 63), "modifiers", None),
+    ],
+)
+def test_batch_coerces_values_per_field(environment_str, field, expected):
+    windows_df = extract_environment_info_batch(pd.Series([environment_str, environment([window()])]))
+
+    rows = batch_rows(windows_df)
+    assert len(rows) == 2
+    assert rows[0][field] == expected
+    assert rows[1] == extract_environment_info(environment([window()]))[0]
+
+
+def test_extract_environment_info_keeps_raw_values():
+    environment_str = environment([window(window_left=1.5, is_active=1)], mouse_x=10.5, timestamp=1700000000)
+
+    (window_info,) = extract_environment_info(environment_str)
+
+    assert window_info["window_left"] == 1.5
+    assert window_info["mouse_x"] == 10.5
+    assert window_info["is_active"] == 1
+    assert window_info["timestamp"] == 1700000000
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from app.models.event_models import EVENT_SCHEMA, Root
+from app.utils import json_processor
+from app.utils.json_processor import (
+    events_to_table,
+    parse_json_files_to_table,
+    read_events_table,
+)
+
+EVENT = {
+    "id": 1,
+    "batch_id": 7,
+    "user_id": "user-1",
+    "timestamp": "2024-01-01T00:00:00",
+    "event_type": "window",
+    "record_id": "rec-1",
+    "related_file": "file.wav",
+    "log_record_counter": 3,
+    "event_context": "ctx",
+    "environment": "{}",
+}
+
+
+def write_json(path, data, prefix=b""):
+    path.write_bytes(prefix + json.dumps(data).encode("utf-8"))
+    return str(path)
+
+
+def from_dict_table(data):
+    return events_to_table(Root.from_dict(data).base_events)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"base_events": [EVENT, dict(EVENT, id=2, user_id="user-2")], "audio_events": [{"id": 5}]},
+        # Отсутствующие поля: те же значения по умолчанию, что и в BaseEvent.from_dict
+        {"base_events": [{"id": 3, "user_id": "user-3"}, {"environment": "{}"}]},
+        # id строкой не укладывается в схему и читается через Root.from_dict
+        {"base_events": [dict(EVENT, id="42")]},
+        {"base_events": []},
+        {"audio_events": []},
+        # null в списке событий пропускается, как в Root.from_dict
+        {"base_events": [EVENT, None]},
+        {"base_events": [None]},
+    ],
+)
+def test_read_events_table_matches_from_dict(tmp_path, data):
+    table = read_events_table(write_json(tmp_path / "events.json", data))
+
+    assert table.schema == EVENT_SCHEMA
+    assert table.equals(from_dict_table(data))
+
+
+def test_read_events_table_over_block_size_limit(tmp_path, monkeypatch):
+    # Файл больше допустимого block_size читается через Root.from_dict, без pyarrow.json
+    monkeypatch.setattr(json_processor, "MAX_JSON_BLOCK_SIZE", 16)
+
+    def fail_read_json(*args, **kwargs):
+        raise AssertionError("read_json не должен вызываться")
+
+    monkeypatch.setattr(json_processor.pa_json, "read_json", fail_read_json)
+    data = {"base_events": [EVENT, dict(EVENT, id=2)]}
+    table = read_events_table(write_json(tmp_path / "events.json", data))
+
+    assert table.equals(from_dict_table(data))
+
+
+def test_read_events_table_with_bom(tmp_path):
+    data = {"base_events": [EVENT]}
+    table = read_events_table(write_json(tmp_path / "events.json", data, prefix=b"\xef\xbb\xbf"))
+
+    assert table.equals(from_dict_table(data))
+
+
+def make_batch_dir(base_path):
+    batch_dir = base_path / "Manuspect" / "logs" / "EventLogger" / "user" / "batch-1"
+    batch_dir.mkdir(parents=True)
+    return batch_dir
+
+
+def test_parse_json_files_to_table_skips_bad_files(tmp_path):
+    batch_dir = make_batch_dir(tmp_path)
+    write_json(batch_dir / "a.json", {"base_events": [EVENT]})
+    write_json(batch_dir / "b.json", {"base_events": [dict(EVENT, id=2)]})
+    (batch_dir / "empty.json").write_bytes(b"")
+    (batch_dir / "broken.json").write_bytes(b"{not json")
+    # Файлы вне папок batch-* не читаются
+    write_json(batch_dir.parent / "other.json", {"base_events": [dict(EVENT, id=3)]})
+
+    table = parse_json_files_to_table(str(tmp_path))
+
+    assert table.schema == EVENT_SCHEMA
+    assert sorted(table.column("id").to_pylist()) == [1, 2]
+
+
+def test_parse_json_files_to_table_without_files(tmp_path):
+    table = parse_json_files_to_table(str(tmp_path))
+
+    assert table.num_rows == 0
+    assert table.schema == EVENT_SCHEMA